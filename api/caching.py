@@ -0,0 +1,73 @@
+import hashlib
+from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Awaitable, Callable, Iterable
+
+from fastapi import Request, Response
+
+from db.conn import AsyncDatabase
+
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    """Weak comparison of an ETag against an If-None-Match header"""
+    if if_none_match.strip() == "*":
+        return True
+    etag = etag.removeprefix("W/")
+    return etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+
+
+def is_not_modified(request: Request, etag: str, last_modified: float) -> bool:
+    """Check the request's validators against the current ETag and modification time"""
+    if if_none_match := request.headers.get("if-none-match"):
+        return etag_matches(etag, if_none_match)
+
+    if if_modified_since := request.headers.get("if-modified-since"):
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # Last-Modified only has one second resolution
+        return int(last_modified) <= since
+
+    return False
+
+
+async def cached_response(
+    request: Request,
+    tables: Iterable[str],
+    build: Callable[[], Awaitable[Response]],
+    changes_daily: bool = False,
+) -> Response:
+    """
+    Serve a response built from database tables with ETag/Last-Modified validators.
+
+    The validators are derived from the tables' data version, so a poll for unchanged data
+    is answered with a 304 without running any queries.
+
+    Args:
+        request: The incoming request
+        tables: The tables the response is built from
+        build: Builds the full response when the client's copy is stale
+        changes_daily: Whether the response also changes at midnight, e.g. "today" windows
+    """
+    version, last_modified = AsyncDatabase.data_version(*tables)
+    if changes_daily:
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        version += f"-{today.date().isoformat()}"
+        last_modified = max(last_modified, today.timestamp())
+
+    # ETags are per URL, but the query string changes the body so it goes into the tag too
+    digest = hashlib.sha1(f"{version}?{request.url.query}".encode()).hexdigest()[:16]
+    headers = {
+        "ETag": f'W/"{digest}"',
+        "Last-Modified": formatdate(last_modified, usegmt=True),
+        "Cache-Control": "no-cache",
+    }
+
+    if is_not_modified(request, headers["ETag"], last_modified):
+        return Response(status_code=304, headers=headers)
+
+    response = await build()
+    if response.status_code == 200:
+        response.headers.update(headers)
+    return response
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Tuple
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# (method, route) -> request count, total and slowest duration
+route_timings: Dict[Tuple[str, str], Dict[str, float]] = {}
+
+
+def route_template(scope: Scope) -> str:
+    """Get the path template of the route that handled a request, so timings group by route"""
+    if route := scope.get("route"):
+        return route.path
+    # Mounted apps (static files) only leave their mount point behind
+    if scope.get("root_path"):
+        return scope["root_path"] + "/{path}"
+    return "(unmatched)"
+
+
+class TimingMiddleware:
+    """
+    Time every request, add a Server-Timing header and log requests slower than
+    SLOW_REQUEST_MS.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.slow_request_ms = float(os.getenv("SLOW_REQUEST_MS", "500"))
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+
+        async def send_timed(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                duration_ms = (time.perf_counter() - started) * 1000
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", f"app;dur={duration_ms:.1f}")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            route = route_template(scope)
+            timing = route_timings.setdefault(
+                (scope["method"], route), {"count": 0, "total_ms": 0.0, "max_ms": 0.0}
+            )
+            timing["count"] += 1
+            timing["total_ms"] += duration_ms
+            timing["max_ms"] = max(timing["max_ms"], duration_ms)
+
+            if duration_ms >= self.slow_request_ms:
+                logger.warning(f"Slow request ({duration_ms:.1f}ms): {scope['method']} {route}")
+
+
+def get_route_timings() -> Dict[str, Dict[str, Any]]:
+    """Get the request timings for each route, slowest on average first"""
+    timings = {
+        f"{method} {route}": {
+            "count": timing["count"],
+            "mean_ms": round(timing["total_ms"] / timing["count"], 2),
+            "max_ms": round(timing["max_ms"], 2),
+        }
+        for (method, route), timing in route_timings.items()
+    }
+    return dict(sorted(timings.items(), key=lambda item: -item[1]["mean_ms"]))
+
+
+async def sample_stacks(seconds: float, interval: float = 0.005) -> str:
+    """
+    Sample the event loop thread's stack while the app keeps running.
+
+    Returns:
+        The samples in collapsed stack format ("outer;inner count" per line), which
+        flamegraph.pl and speedscope can read
+    """
+    thread_id = threading.get_ident()
+    samples: Counter = Counter()
+    stop = threading.Event()
+
+    def sampler() -> None:
+        while not stop.wait(interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                frame = frame.f_back
+            samples[";".join(reversed(stack))] += 1
+
+    thread = threading.Thread(target=sampler, name="stack-sampler", daemon=True)
+    thread.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        stop.set()
+        thread.join()
+
+    return "\n".join(f"{stack} {count}" for stack, count in samples.most_common())
@@ -0,0 +1,74 @@
+import ipaddress
+from datetime import timedelta
+from decimal import Decimal
+from typing import Any, Dict, List
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+# Formats a list of rows can be returned in
+ROW_FORMATS = ("rows", "columns")
+
+IP_TYPES = (
+    ipaddress.IPv4Address,
+    ipaddress.IPv6Address,
+    ipaddress.IPv4Interface,
+    ipaddress.IPv6Interface,
+    ipaddress.IPv4Network,
+    ipaddress.IPv6Network,
+)
+
+
+def _default(obj: Any) -> Any:
+    """Serialize the types orjson doesn't handle natively, the same way jsonable_encoder does"""
+    if isinstance(obj, Decimal):
+        # Whole numbers stay integers
+        return int(obj) if obj.as_tuple().exponent >= 0 else float(obj)
+    if isinstance(obj, timedelta):
+        return obj.total_seconds()
+    if isinstance(obj, bytes):
+        return obj.decode()
+    if isinstance(obj, IP_TYPES):
+        return str(obj)
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    # Anything rarer falls back to jsonable_encoder itself
+    return jsonable_encoder(obj)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson.
+
+    Database rows can be passed straight through, datetimes and Decimals are encoded
+    natively instead of being walked by jsonable_encoder first.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def to_columns(rows: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """Convert a list of rows to one list per column"""
+    if not rows:
+        return {}
+    return {column: [row[column] for row in rows] for column in rows[0]}
+
+
+def rows_response(rows: List[Dict[str, Any]], format: str = "rows") -> FastJSONResponse:
+    """
+    Build a response for a list of rows.
+
+    Args:
+        rows: The rows to return
+        format: "rows" for a list of objects, "columns" for one array per column
+    """
+    if format not in ROW_FORMATS:
+        return FastJSONResponse(
+            status_code=400,
+            content={"message": f"format must be one of: {', '.join(ROW_FORMATS)}"},
+        )
+    if format == "columns":
+        return FastJSONResponse(content=to_columns(rows))
+    return FastJSONResponse(content=rows)
@@ -0,0 +1,97 @@
+import hashlib
+import os
+import re
+from functools import lru_cache
+from typing import Dict, Optional
+
+from fastapi.responses import HTMLResponse
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers, QueryParams
+from starlette.responses import Response
+
+from api.caching import etag_matches
+
+# Cache-Control for URLs that include a hash of the file's content
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# Root-relative href/src attributes in HTML pages
+ASSET_REFERENCE = re.compile(r'(?P<attr>href|src)="(?P<url>/[^"?#]+)"')
+
+
+@lru_cache(maxsize=256)
+def _content_hash(path: str, mtime: float, size: int) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+
+def content_hash(path: str, stat_result: Optional[os.stat_result] = None) -> str:
+    """Get a short hash of a file's content, cached until the file changes"""
+    stat_result = stat_result or os.stat(path)
+    return _content_hash(str(path), stat_result.st_mtime, stat_result.st_size)
+
+
+class AssetStaticFiles(StaticFiles):
+    """
+    Static files with cache headers for content-hashed URLs.
+
+    Files requested as ?v=<content hash> are cached as immutable, anything else has to be
+    revalidated. HTML pages have their references to files under asset_dirs rewritten to
+    hashed URLs, so browsers only download css/js again when it changes. Directories whose
+    file names are already content hashes can be served as immutable outright.
+    """
+
+    def __init__(
+        self,
+        *args,
+        asset_dirs: Optional[Dict[str, str]] = None,
+        immutable: bool = False,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        # URL prefix -> directory it is served from, e.g. {"/css": "web/css"}
+        self.asset_dirs = asset_dirs or {}
+        self.immutable = immutable
+
+    def asset_url(self, url: str) -> str:
+        """Add the content hash to a URL if it points at a known asset"""
+        for prefix, directory in self.asset_dirs.items():
+            if url.startswith(prefix + "/"):
+                path = os.path.join(directory, url.removeprefix(prefix + "/"))
+                if os.path.isfile(path):
+                    return f"{url}?v={content_hash(path)}"
+        return url
+
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope,
+        status_code: int = 200,
+    ) -> Response:
+        if self.asset_dirs and str(full_path).endswith(".html"):
+            return self.html_response(full_path, Headers(scope=scope), status_code)
+
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        version = QueryParams(scope["query_string"]).get("v")
+        if self.immutable or (
+            version is not None and version == content_hash(full_path, stat_result)
+        ):
+            response.headers["Cache-Control"] = IMMUTABLE
+        else:
+            response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    def html_response(self, full_path, request_headers: Headers, status_code: int) -> Response:
+        with open(full_path, encoding="utf-8") as f:
+            html = f.read()
+        html = ASSET_REFERENCE.sub(lambda m: f'{m["attr"]}="{self.asset_url(m["url"])}"', html)
+        content = html.encode("utf-8")
+
+        headers = {
+            "ETag": f'"{hashlib.sha256(content).hexdigest()[:16]}"',
+            "Cache-Control": "no-cache",
+        }
+        if_none_match = request_headers.get("if-none-match")
+        if status_code == 200 and if_none_match and etag_matches(headers["ETag"], if_none_match):
+            return Response(status_code=304, headers=headers)
+        return HTMLResponse(content, status_code=status_code, headers=headers)
@@ -1,6 +1,10 @@
 import logging
 import os
-from typing import Any, Dict, List, Optional, Set
+import re
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
 
 import asyncpg
 
@@ -19,18 +23,198 @@ def get_db_connection_params() -> Dict[str, Any]:
     }
 
 
+def get_db_read_connection_params() -> Dict[str, Any]:
+    """Get read pool connection parameters from environment variables, defaulting to the primary"""
+    primary = get_db_connection_params()
+    return {
+        "host": os.getenv("DATABASE_READ_HOST", primary["host"]),
+        "port": int(os.getenv("DATABASE_READ_PORT", str(primary["port"]))),
+        "user": os.getenv("DATABASE_READ_USER", primary["user"]),
+        "password": os.getenv("DATABASE_READ_PASSWORD", primary["password"]),
+        "database": os.getenv("DATABASE_READ_NAME", primary["database"]),
+    }
+
+
+def get_db_pool_settings() -> Dict[str, Any]:
+    """Get connection pool sizes and read routing settings from environment variables"""
+    replica = "DATABASE_READ_HOST" in os.environ
+    return {
+        "max_size": int(os.getenv("DATABASE_POOL_MAX_SIZE", "10")),
+        "read_max_size": int(os.getenv("DATABASE_READ_POOL_MAX_SIZE", "10")),
+        # Reads of tables written more recently than this go to the primary, to cover replica
+        # lag. A read pool on the primary itself is never behind.
+        "read_after_write_seconds": float(
+            os.getenv("DATABASE_READ_AFTER_WRITE_SECONDS", "5" if replica else "0")
+        ),
+        # How long a replica's replay position is trusted before it is read again
+        "replay_check_seconds": float(os.getenv("DATABASE_READ_REPLAY_CHECK_SECONDS", "1")),
+    }
+
+
+def get_slow_query_settings() -> Dict[str, Any]:
+    """Get slow query logging settings from environment variables with defaults"""
+    return {
+        "threshold_ms": float(os.getenv("SLOW_QUERY_MS", "200")),
+        "explain": os.getenv("SLOW_QUERY_EXPLAIN", "false").lower() in ("1", "true", "yes"),
+    }
+
+
+# Statements EXPLAIN accepts
+EXPLAINABLE = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|WITH|VALUES)\b", re.IGNORECASE)
+
+SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|(?<![\w$])\d+(?:\.\d+)?\b")
+
+
+def normalize_sql(query: str) -> str:
+    """Collapse whitespace and replace literals, so the same statement always looks the same"""
+    return " ".join(SQL_LITERALS.sub("?", query).split())
+
+
+def param_shapes(params: tuple) -> List[str]:
+    """Describe query parameters by type rather than value"""
+    return [type(param).__name__ for param in params]
+
+
+class _Rollback(Exception):
+    pass
+
+
 class AsyncDatabase:
     _instance = None
     _initialized_tables: Set[str] = set()
     _default_connection_params = get_db_connection_params()
+    _default_read_connection_params = get_db_read_connection_params()
+    _pool_settings = get_db_pool_settings()
+
+    # Per-table write counters and times, used to validate cached API responses.
+    # Writes that can touch any table are recorded under "*".
+    _started_at: float = time.time()
+    _data_versions: Dict[str, int] = {}
+    _data_modified: Dict[str, float] = {}
+
+    # Most recent statements slower than the slow query threshold
+    _slow_query_settings = get_slow_query_settings()
+    slow_queries: Deque[Dict[str, Any]] = deque(maxlen=100)
 
     def __init__(self, connection_params: Optional[Dict[str, Any]] = None):
         self.connection_params = connection_params or self._default_connection_params
+        # Custom connection params read from the same database they write to
+        if connection_params is None or connection_params == self._default_connection_params:
+            self.read_connection_params = self._default_read_connection_params
+        else:
+            self.read_connection_params = connection_params
         self.pool = None
+        self.read_pool = None
+        # Whether the read pool is on another server, which may lag behind the primary
+        self.replica = self.read_connection_params != self.connection_params
+        # WAL position the replica has replayed up to, and when that was checked
+        self.replayed_lsn = 0
+        self.replay_checked_at = 0.0
+        # Primary WAL position read after the writes made before written_lsn_at. The
+        # position from before this process started is unknown, so it is read on first use.
+        self.written_lsn = 0
+        self.written_lsn_at = -1.0
 
     async def initialize_pool(self):
+        settings = self._pool_settings
         if not self.pool:
-            self.pool = await asyncpg.create_pool(**self.connection_params)
+            self.pool = await asyncpg.create_pool(
+                **self.connection_params,
+                min_size=min(10, settings["max_size"]),
+                max_size=settings["max_size"],
+            )
+        if not self.read_pool:
+            self.read_pool = await asyncpg.create_pool(
+                **self.read_connection_params,
+                min_size=1,
+                max_size=settings["read_max_size"],
+            )
+
+    async def get_pool(self, read_only: bool = False, tables: Tuple[str, ...] = ()):
+        """
+        Get the pool a statement should run on.
+
+        Read-only statements go to the read pool, unless one of the tables they read (any
+        table if none are given) was written too recently for the read pool to have caught up.
+        A replica is only read from once its replayed WAL position has reached the primary's
+        position after the last write to those tables, so responses are never older than
+        their data version.
+        """
+        if not read_only:
+            return self.pool
+
+        if tables:
+            modified = [self._data_modified.get(name, 0) for name in ("*",) + tables]
+        else:
+            modified = list(self._data_modified.values())
+        last_write = max(modified, default=0)
+
+        window = self._pool_settings["read_after_write_seconds"]
+        if window > 0 and time.time() - last_write < window:
+            return self.pool
+        if self.replica:
+            needed = await self.get_written_lsn(last_write)
+            if await self.get_replayed_lsn(needed) < needed:
+                return self.pool
+        return self.read_pool
+
+    async def get_written_lsn(self, last_write: float) -> float:
+        """
+        Get a primary WAL position that includes every write made up to last_write.
+
+        Writes are recorded after they commit, so the primary's current position read after
+        that covers them. It is only read again once a newer write has been recorded.
+        """
+        if last_write < self.written_lsn_at:
+            return self.written_lsn
+
+        # Both times are from this process's clock, so they can be compared
+        checked_at = time.time()
+        query = "SELECT (pg_current_wal_lsn() - '0/0'::pg_lsn)::bigint AS lsn"
+        try:
+            async with self.pool.acquire() as connection:
+                row = await connection.fetchrow(query)
+        except Exception as e:
+            logger.error(f"Failed to read primary WAL position: {e}")
+            # Unknown, so no replica position is recent enough
+            return float("inf")
+
+        self.written_lsn = row["lsn"]
+        self.written_lsn_at = checked_at
+        return self.written_lsn
+
+    async def get_replayed_lsn(self, needed: float) -> float:
+        """
+        Get the WAL position the replica has replayed up to.
+
+        The position is cached briefly and only ever moves forward, so a cached position is
+        at most behind the real one. That can send reads to the primary needlessly, but never
+        to a replica that is missing a write.
+        """
+        now = time.time()
+        if self.replayed_lsn >= needed or (
+            now - self.replay_checked_at < self._pool_settings["replay_check_seconds"]
+        ):
+            return self.replayed_lsn
+
+        query = """
+            SELECT pg_is_in_recovery() AS standby,
+                (pg_last_wal_replay_lsn() - '0/0'::pg_lsn)::bigint AS lsn
+        """
+        try:
+            async with self.read_pool.acquire() as connection:
+                row = await connection.fetchrow(query)
+        except Exception as e:
+            logger.error(f"Failed to read replica WAL position: {e}")
+            return 0
+
+        if not row["standby"]:
+            # Not a standby, so it can't be behind
+            self.replayed_lsn = float("inf")
+        else:
+            self.replayed_lsn = row["lsn"] or 0
+        self.replay_checked_at = now
+        return self.replayed_lsn
 
     @classmethod
     async def get_instance(cls, connection_params: Optional[Dict[str, Any]] = None):
@@ -46,22 +230,82 @@ class AsyncDatabase:
         await self.initialize_pool()
         async with self.pool.acquire() as connection:
             logging.debug(f"Executing query: {query} with params: {params}")
+            started = time.perf_counter()
             await connection.execute(query, *params)
-
-    async def fetchone(self, query: str, params: tuple = ()) -> Optional[Dict[str, Any]]:
+            await self.log_if_slow(connection, query, params, started)
+
+    async def fetchone(
+        self,
+        query: str,
+        params: tuple = (),
+        read_only: bool = False,
+        tables: Tuple[str, ...] = (),
+    ) -> Optional[Dict[str, Any]]:
         await self.initialize_pool()
-        async with self.pool.acquire() as connection:
+        pool = await self.get_pool(read_only, tables)
+        async with pool.acquire() as connection:
             logger.debug(f"Fetching one row with query: {query} and params: {params}")
+            started = time.perf_counter()
             row = await connection.fetchrow(query, *params)
+            await self.log_if_slow(connection, query, params, started)
             return dict(row) if row else None
 
-    async def fetchall(self, query: str, params: tuple = ()) -> List[Dict[str, Any]]:
+    async def fetchall(
+        self,
+        query: str,
+        params: tuple = (),
+        read_only: bool = False,
+        tables: Tuple[str, ...] = (),
+    ) -> List[Dict[str, Any]]:
         await self.initialize_pool()
-        async with self.pool.acquire() as connection:
+        pool = await self.get_pool(read_only, tables)
+        async with pool.acquire() as connection:
             logger.debug(f"Fetching all rows with query: {query} and params: {params}")
+            started = time.perf_counter()
             rows = await connection.fetch(query, *params)
+            await self.log_if_slow(connection, query, params, started)
             return [dict(row) for row in rows]
 
+    async def log_if_slow(self, connection, query: str, params: tuple, started: float) -> None:
+        """Record a statement in the slow query log if it took longer than the threshold"""
+        duration_ms = (time.perf_counter() - started) * 1000
+        settings = self._slow_query_settings
+        if duration_ms < settings["threshold_ms"]:
+            return
+
+        entry = {
+            "time": time.time(),
+            "duration_ms": round(duration_ms, 2),
+            "query": normalize_sql(query),
+            "params": param_shapes(params),
+        }
+        logger.warning(
+            f"Slow query ({entry['duration_ms']}ms): {entry['query']} params: {entry['params']}"
+        )
+
+        if settings["explain"] and EXPLAINABLE.match(query):
+            entry["plan"] = await self.explain(connection, query, params)
+
+        self.slow_queries.append(entry)
+
+    async def explain(self, connection, query: str, params: tuple) -> Optional[str]:
+        """
+        Get the EXPLAIN (ANALYZE, BUFFERS) plan for a statement.
+
+        ANALYZE runs the statement again, so it's done in a transaction that is rolled back.
+        """
+        plan = None
+        try:
+            async with connection.transaction():
+                rows = await connection.fetch(f"EXPLAIN (ANALYZE, BUFFERS) {query}", *params)
+                plan = "\n".join(row[0] for row in rows)
+                raise _Rollback()
+        except _Rollback:
+            pass
+        except Exception as e:
+            logger.error(f"Failed to explain slow query: {e}")
+        return plan
+
     async def table_exists(self, table_name: str) -> bool:
         query = """
             SELECT EXISTS (
@@ -73,6 +317,24 @@ class AsyncDatabase:
         result = await self.fetchone(query, (table_name,))
         return result and result.get("exists", False)
 
+    @classmethod
+    def bump_data_version(cls, table_name: str = "*") -> None:
+        """Record a write to a table, or to any table if no name is given"""
+        cls._data_versions[table_name] = cls._data_versions.get(table_name, 0) + 1
+        cls._data_modified[table_name] = time.time()
+
+    @classmethod
+    def data_version(cls, *table_names: str) -> Tuple[str, float]:
+        """
+        Get a version token and last modified time covering writes to the given tables.
+
+        The token changes whenever any of the tables is written to, or the process restarts.
+        """
+        names = ("*",) + table_names
+        token = "-".join(str(cls._data_versions.get(name, 0)) for name in names)
+        modified = max(cls._data_modified.get(name, cls._started_at) for name in names)
+        return f"{int(cls._started_at)}-{token}", modified
+
     @staticmethod
     def is_valid_identifier(name: str) -> bool:
         """Check if a string is a valid SQL identifier name"""
@@ -83,6 +345,7 @@ class BaseModelDB:
     table_name: str = ""
     connection_params: Dict[str, Any] = None  # Will use default from AsyncDatabase
     schema_definition: str = ""
+    index_definitions: List[str] = []
 
     @classmethod
     async def get_db(cls) -> AsyncDatabase:
@@ -107,6 +370,10 @@ class BaseModelDB:
                 raise ValueError(f"No schema defined for {cls.__name__}")
             await db.execute(cls.schema_definition)
 
+        # Indexes may be added after the table was first created
+        for index_definition in cls.index_definitions:
+            await db.execute(index_definition)
+
         # Mark as initialized
         AsyncDatabase._initialized_tables.add(cls.table_name)
 
@@ -128,6 +395,7 @@ class BaseModelDB:
         param_indices = ", ".join([f"${i+1}" for i in range(len(kwargs))])
         query = f'INSERT INTO "{cls.table_name}" ({columns}) VALUES ({param_indices})'
         await (await cls.get_db()).execute(query, tuple(kwargs.values()))
+        AsyncDatabase.bump_data_version(cls.table_name)
 
     @classmethod
     async def get(cls, **kwargs):
@@ -144,10 +412,12 @@ class BaseModelDB:
         return await (await cls.get_db()).fetchone(query, tuple(kwargs.values()))
 
     @classmethod
-    async def all(cls):
+    async def all(cls, read_only: bool = False):
         await cls.initialize()
         query = f'SELECT * FROM "{cls.table_name}"'
-        return await (await cls.get_db()).fetchall(query)
+        return await (await cls.get_db()).fetchall(
+            query, read_only=read_only, tables=(cls.table_name,)
+        )
 
     @classmethod
     async def delete(cls, **kwargs):
@@ -162,6 +432,7 @@ class BaseModelDB:
         conditions = " AND ".join([f'"{key}" = ${i+1}' for i, key in enumerate(kwargs)])
         query = f'DELETE FROM "{cls.table_name}" WHERE {conditions}'
         await (await cls.get_db()).execute(query, tuple(kwargs.values()))
+        AsyncDatabase.bump_data_version(cls.table_name)
 
     @classmethod
     async def update(cls, id: int, **kwargs):
@@ -176,6 +447,7 @@ class BaseModelDB:
         set_clause = ", ".join([f'"{key}" = ${i+2}' for i, key in enumerate(kwargs)])
         query = f'UPDATE "{cls.table_name}" SET {set_clause} WHERE id = $1'
         await (await cls.get_db()).execute(query, (id,) + tuple(kwargs.values()))
+        AsyncDatabase.bump_data_version(cls.table_name)
 
     @classmethod
     async def upsert(cls, **kwargs):
@@ -193,6 +465,7 @@ class BaseModelDB:
             ON CONFLICT (id) DO UPDATE SET {update_clause}
         """
         await (await cls.get_db()).execute(query, tuple(kwargs.values()))
+        AsyncDatabase.bump_data_version(cls.table_name)
 
     @classmethod
     async def new(cls, **kwargs):
@@ -205,7 +478,9 @@ class BaseModelDB:
         columns = ", ".join(f'"{key}"' for key in kwargs)
         param_indices = ", ".join([f"${i+1}" for i in range(len(kwargs))])
         query = f'INSERT INTO "{cls.table_name}" ({columns}) VALUES ({param_indices}) RETURNING *'
-        return await (await cls.get_db()).fetchone(query, tuple(kwargs.values()))
+        row = await (await cls.get_db()).fetchone(query, tuple(kwargs.values()))
+        AsyncDatabase.bump_data_version(cls.table_name)
+        return row
 
 
 # Example usage - no need to specify connection params anymore
@@ -232,6 +507,24 @@ class Machine(BaseModelDB):
     )
     """
 
+    # Data version of the last_seen column, which heartbeats update without touching the
+    # rest of the table. Only responses that include last_seen are validated against it.
+    last_seen_version = "machines.last_seen"
+
+    @classmethod
+    async def touch(cls, id: str, last_seen: datetime) -> bool:
+        """
+        Update when a machine was last seen, returning False if the machine doesn't exist.
+
+        Only the last_seen version is bumped, so responses without last_seen stay cached.
+        """
+        await cls.initialize()
+        query = f'UPDATE "{cls.table_name}" SET last_seen = $2 WHERE id = $1 RETURNING id'
+        touched = await (await cls.get_db()).fetchone(query, (id, last_seen)) is not None
+        if touched:
+            AsyncDatabase.bump_data_version(cls.last_seen_version)
+        return touched
+
 
 class Game(BaseModelDB):
     table_name = "games"
@@ -243,6 +536,11 @@ class Game(BaseModelDB):
         active BOOLEAN NOT NULL DEFAULT TRUE
     )
     """
+    index_definitions = [
+        """
+        CREATE INDEX IF NOT EXISTS "games_machine_id_date" ON "games" (machine_id, date)
+        """
+    ]
 
     @classmethod
     async def set_active(cls, id: int, active: bool = True):
@@ -267,6 +565,24 @@ class Play(BaseModelDB):
         duration_seconds INTEGER
     )
     """
+    index_definitions = [
+        """
+        CREATE INDEX IF NOT EXISTS "plays_game_id" ON "plays" (game_id)
+        """
+    ]
+
+
+class BackglassImage(BaseModelDB):
+    table_name = "backglass_images"
+    schema_definition = """
+    CREATE TABLE IF NOT EXISTS "backglass_images" (
+        id TEXT PRIMARY KEY,
+        version TEXT NOT NULL,
+        hash TEXT NOT NULL,
+        variants JSONB NOT NULL,
+        fetched_at TIMESTAMP NOT NULL
+    )
+    """
 
 
 class GameState(BaseModelDB):
@@ -279,3 +595,23 @@ class GameState(BaseModelDB):
         timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
     )
     """
+    index_definitions = [
+        """
+        CREATE INDEX IF NOT EXISTS "game_states_game_id_timestamp"
+            ON "game_states" (game_id, timestamp)
+        """
+    ]
+
+    @classmethod
+    async def duration_seconds(cls, game_id: int) -> Optional[int]:
+        """Get the time between a game's first and last recorded states"""
+        await cls.initialize()
+        query = f"""
+            SELECT MIN(timestamp) AS started, MAX(timestamp) AS ended
+            FROM "{cls.table_name}"
+            WHERE game_id = $1
+        """
+        result = await (await cls.get_db()).fetchone(query, (game_id,))
+        if result is None or result["started"] is None:
+            return None
+        return int((result["ended"] - result["started"]).total_seconds())
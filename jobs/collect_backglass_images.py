@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+from db.conn import BackglassImage, Machine
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional, without it only the original image is served
+    Image = None
+
+# Errors from a download that isn't a usable image
+IMAGE_ERRORS: Tuple[type, ...] = (OSError, ValueError)
+if Image is not None:
+    # Raised for images too large to decode safely, it isn't an OSError
+    IMAGE_ERRORS += (Image.DecompressionBombError,)
+
+# Where images are stored, served under /img/backglass
+BACKGLASS_DIR = "web/img/backglass"
+BACKGLASS_URL_PREFIX = "/img/backglass"
+
+# URL a board serves its backglass image from
+BACKGLASS_URL = os.getenv("BACKGLASS_URL", "http://{ip}/api/backglass")
+
+# Widths of the resized copies, covering the kiosk displays from small panels up to 1080p
+VARIANT_WIDTHS = (320, 640, 1280, 1920)
+VARIANT_QUALITY = 80
+
+# Extensions for the image formats a board may send
+EXTENSIONS = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/webp": "webp",
+    "image/gif": "gif",
+}
+
+# Retry a failed fetch after this long, doubling with each failure up to the maximum
+RETRY_SECONDS = 60 * 5
+MAX_RETRY_SECONDS = 60 * 60 * 24
+
+# (machine id, version) -> failed fetches so far and when to try again
+failed_fetches: Dict[Tuple[str, str], Tuple[int, float]] = {}
+
+logger = logging.getLogger(__name__)
+
+
+def store_file(name: str, data: bytes) -> str:
+    """Write a content-addressed file once and return its URL"""
+    path = os.path.join(BACKGLASS_DIR, name)
+    if not os.path.exists(path):
+        # Write to a temporary file first so a half-written image is never served
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+    return f"{BACKGLASS_URL_PREFIX}/{name}"
+
+
+def store_image(data: bytes, content_type: str) -> Dict[str, Any]:
+    """
+    Store an image and its resized variants.
+
+    Returns:
+        The image's content hash and its variants, smallest first, as {"width", "url"} dicts
+    """
+    if Image is not None:
+        # Check the download really is an image before anything is written, and name it
+        # after the format Pillow found rather than the board's Content-Type
+        with Image.open(io.BytesIO(data)) as image:
+            image.verify()
+            content_type = Image.MIME.get(image.format, "")
+    extension = EXTENSIONS.get(content_type.split(";")[0].strip())
+    if extension is None:
+        raise ValueError(f"Not a web image: {content_type or 'unknown type'}")
+
+    os.makedirs(BACKGLASS_DIR, exist_ok=True)
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    original_url = store_file(f"{digest}.{extension}", data)
+
+    variants: List[Dict[str, Any]] = []
+    if Image is None:
+        logger.warning("Pillow is not installed, serving backglass images at full size")
+        return {"hash": digest, "variants": [{"width": None, "url": original_url}]}
+
+    # verify() leaves the image unusable, so it's opened again to resize it
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert("RGB")
+        for width in VARIANT_WIDTHS:
+            if width >= image.width:
+                break
+            height = round(image.height * width / image.width)
+            buffer = io.BytesIO()
+            image.resize((width, height), Image.LANCZOS).save(
+                buffer, "WEBP", quality=VARIANT_QUALITY, method=6
+            )
+            url = store_file(f"{digest}-{width}w.webp", buffer.getvalue())
+            variants.append({"width": width, "url": url})
+
+        variants.append({"width": image.width, "url": original_url})
+
+    return {"hash": digest, "variants": variants}
+
+
+def fetch_image(machine_ip: str) -> Optional[Dict[str, Any]]:
+    """Download a machine's backglass and store it, returning None if it couldn't be fetched"""
+    url = BACKGLASS_URL.format(ip=machine_ip)
+    try:
+        response = requests.get(url, timeout=30)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        logger.error(f"Error fetching backglass from {url}: {e}")
+        return None
+
+    try:
+        return store_image(response.content, response.headers.get("content-type", ""))
+    except IMAGE_ERRORS as e:
+        logger.error(f"Error storing backglass from {url}: {e}")
+        return None
+
+
+async def collect_backglass_images() -> None:
+    """
+    Fetch the backglass image of each machine that doesn't have one for its current version.
+    """
+    await BackglassImage.initialize()
+
+    stored = {image["id"]: image for image in await BackglassImage.all()}
+
+    for machine in await Machine.all():
+        image = stored.get(machine["id"])
+        if image is not None and image["version"] == machine["version"]:
+            continue
+
+        # Back off from machines whose current version couldn't be fetched
+        key = (machine["id"], machine["version"])
+        failures, retry_at = failed_fetches.get(key, (0, 0))
+        if time.time() < retry_at:
+            continue
+
+        logger.info(f"Fetching backglass for {machine['title']} ({machine['version']})")
+
+        # Downloading and resizing block, keep them off the event loop the listeners run on
+        result = await asyncio.to_thread(fetch_image, machine["ip"])
+        if result is None:
+            delay = min(RETRY_SECONDS * 2**failures, MAX_RETRY_SECONDS)
+            failed_fetches[key] = (failures + 1, time.time() + delay)
+            logger.info(f"Retrying backglass for {machine['title']} in {delay}s")
+            continue
+
+        failed_fetches.pop(key, None)
+
+        await BackglassImage.upsert(
+            id=machine["id"],
+            version=machine["version"],
+            hash=result["hash"],
+            variants=json.dumps(result["variants"]),
+            fetched_at=datetime.now(),
+        )
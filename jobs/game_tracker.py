@@ -0,0 +1,92 @@
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# The non-zero (initials, score) entries of a final score, in player order
+ScoreEntries = Tuple[Tuple[str, int], ...]
+
+
+def score_entries(players: List[Any]) -> ScoreEntries:
+    """Get the entries a final score's players (msg["game"][1:]) are written as"""
+    return tuple((player[0], player[1]) for player in players if player[1] != 0)
+
+
+class TrackedGame:
+    """A game seen by the game state listener during this process's lifetime"""
+
+    def __init__(
+        self,
+        game_id: int,
+        machine_id: str,
+        scored: bool = False,
+        final_score: Optional[ScoreEntries] = None,
+    ):
+        self.game_id = game_id
+        self.machine_id = machine_id
+        # Whether a final score has already been recorded for this game
+        self.scored = scored
+        # The entries that score was written as, to recognise repeats of it
+        self.final_score = final_score
+
+
+# machine_id -> game currently in progress on that machine
+active_games: Dict[str, TrackedGame] = {}
+
+# machine_id -> most recently finished game on that machine, waiting for its final score
+ended_games: Dict[str, TrackedGame] = {}
+
+# machine_id -> final score that arrived before its game's end was processed, and when
+held_final_scores: Dict[str, Tuple[Dict[str, Any], datetime]] = {}
+
+
+def game_started(machine_id: str, game_id: int) -> None:
+    """Record that a new game has started on a machine"""
+    logger.debug(f"Tracking game {game_id} on {machine_id}")
+    active_games[machine_id] = TrackedGame(game_id, machine_id)
+    # A score still held from before this game can't belong to it
+    if held_final_scores.pop(machine_id, None) is not None:
+        logger.warning(f"Dropping held final score for {machine_id}, its game end was not seen")
+
+
+def game_ended(machine_id: str, game_id: int) -> None:
+    """Record that a machine's game has finished"""
+    game = active_games.pop(machine_id, None)
+    if game is None or game.game_id != game_id:
+        game = TrackedGame(game_id, machine_id)
+    ended_games[machine_id] = game
+
+
+def last_ended_game(machine_id: str) -> Optional[TrackedGame]:
+    """Get the most recently finished game on a machine, if one was seen by this process"""
+    return ended_games.get(machine_id)
+
+
+def remember_ended_game(
+    machine_id: str, game_id: int, final_score: Optional[ScoreEntries] = None
+) -> TrackedGame:
+    """Record a machine's last finished game loaded from the db, with its score if it has one"""
+    game = TrackedGame(game_id, machine_id, scored=final_score is not None, final_score=final_score)
+    ended_games[machine_id] = game
+    return game
+
+
+def mark_scored(machine_id: str, game_id: int, final_score: ScoreEntries) -> None:
+    """Record that a game's final score has been stored, so duplicates can be dropped"""
+    game = ended_games.get(machine_id)
+    if game is None or game.game_id != game_id:
+        game = ended_games[machine_id] = TrackedGame(game_id, machine_id)
+    game.scored = True
+    game.final_score = final_score
+
+
+def hold_final_score(machine_id: str, msg: Dict[str, Any], received_at: datetime) -> None:
+    """Keep a final score until the machine's current game has ended"""
+    logger.info(f"Holding final score for {machine_id} until its game ends")
+    held_final_scores[machine_id] = (msg, received_at)
+
+
+def pop_held_final_score(machine_id: str) -> Optional[Tuple[Dict[str, Any], datetime]]:
+    """Take the final score held for a machine, if there is one"""
+    return held_final_scores.pop(machine_id, None)
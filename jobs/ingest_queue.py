@@ -0,0 +1,109 @@
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Kinds of queued messages
+GAME_STATE = "game_state"
+FINAL_SCORE = "final_score"
+
+# A queued message: its kind, the decoded message and when it was received
+QueueItem = Tuple[str, Dict[str, Any], datetime]
+
+
+class IngestQueue:
+    """
+    Bounded queue between the UDP receive loops and the database writes.
+
+    Game start/end transitions and final scores go into a FIFO priority lane. Other game
+    states are kept per machine, with a newer state replacing one that hasn't been written
+    yet. Under overload intermediate states are coalesced or dropped, game boundaries are not.
+    """
+
+    def __init__(self, max_states: int = 256, max_priority: int = 4096):
+        self.max_states = max_states
+        self.max_priority = max_priority
+        self.priority: Deque[QueueItem] = deque()
+        # machine_id -> newest unwritten game state and when it was received
+        self.states: "OrderedDict[str, Tuple[Dict[str, Any], datetime]]" = OrderedDict()
+        # machine_id -> GameActive of the last state received, to spot transitions
+        self.last_active: Dict[str, bool] = {}
+        self.stats = {
+            "received": 0,
+            "coalesced": 0,
+            "dropped": 0,
+            "dropped_priority": 0,
+            "processed": 0,
+        }
+        self.ready = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self.priority) + len(self.states)
+
+    def put_game_state(self, msg: Dict[str, Any], received_at: datetime) -> None:
+        """Queue a game state, coalescing it with any unwritten state for the same machine"""
+        machine_id = msg["game_ip"]
+        active = bool(msg["game_status"]["GameActive"])
+        self.stats["received"] += 1
+
+        if self.last_active.get(machine_id) != active:
+            self.last_active[machine_id] = active
+            # The transition is newer than any state still waiting for this machine
+            if self.states.pop(machine_id, None) is not None:
+                self.stats["coalesced"] += 1
+            self._put_priority(GAME_STATE, msg, received_at)
+        elif machine_id in self.states:
+            self.states[machine_id] = (msg, received_at)
+            self.stats["coalesced"] += 1
+        elif len(self.states) >= self.max_states:
+            self.stats["dropped"] += 1
+            logger.debug(f"Ingest queue full, dropping game state for {machine_id}")
+        else:
+            self.states[machine_id] = (msg, received_at)
+
+        self.ready.set()
+
+    def put_final_score(self, msg: Dict[str, Any], received_at: datetime) -> None:
+        """Queue a final score"""
+        self.stats["received"] += 1
+        self._put_priority(FINAL_SCORE, msg, received_at)
+        self.ready.set()
+
+    def _put_priority(self, kind: str, msg: Dict[str, Any], received_at: datetime) -> None:
+        if len(self.priority) >= self.max_priority:
+            self.stats["dropped_priority"] += 1
+            logger.warning(f"Ingest queue full, dropping {kind} for {msg.get('game_ip')}")
+            return
+        self.priority.append((kind, msg, received_at))
+
+    def get_nowait(self) -> Optional[QueueItem]:
+        """Get the next message to write, or None if the queue is empty"""
+        if self.priority:
+            return self.priority.popleft()
+        if self.states:
+            _, (msg, received_at) = self.states.popitem(last=False)
+            return GAME_STATE, msg, received_at
+        return None
+
+    async def get(self) -> QueueItem:
+        """Wait for the next message to write"""
+        while True:
+            item = self.get_nowait()
+            if item is not None:
+                return item
+            self.ready.clear()
+            await self.ready.wait()
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            **self.stats,
+            "pending_priority": len(self.priority),
+            "pending_states": len(self.states),
+        }
+
+
+# Shared by the receive loops and the queue processor
+ingest_queue = IngestQueue()
@@ -2,12 +2,56 @@ import json
 import logging
 import socket
 from datetime import datetime
+from typing import Optional, Tuple
 
 from db.conn import Machine
+from jobs.packet_capture import capture_packet
+
+# The UDP port used for discovery
+DISCOVERY_PORT = 37020
 
 # Global socket variable that persists between function calls
 recv_sock = None
 
+# machine id -> (ip, title, version) last written, so heartbeats only update last_seen
+announced = {}
+
+logger = logging.getLogger(__name__)
+
+
+async def handle_packet(
+    data: bytes, addr: Tuple[str, int], received_at: Optional[datetime] = None
+) -> None:
+    """
+    Handle a single board announcement datagram.
+
+    Args:
+        received_at: When the datagram arrived, defaults to now. Replays pass the capture time.
+    """
+    received_at = received_at or datetime.now()
+
+    try:
+        msg = json.loads(data.decode("utf-8"))
+        logger.debug(f"Received message: {msg}")
+    except json.JSONDecodeError:
+        return
+
+    # Check for required fields
+    if "name" in msg and "version" in msg and "ip" in msg:
+        title = msg["name"]
+        version = msg["version"]
+        ip = msg["ip"]  # Use IP from the message
+
+        logger.info(f"Board announcement from {title} at {ip} (version: {version})")
+
+        # Update database
+        unchanged = announced.get(ip) == (ip, title, version)
+        if not unchanged or not await Machine.touch(id=ip, last_seen=received_at):
+            await Machine.upsert(id=ip, ip=ip, title=title, version=version, last_seen=received_at)
+            announced[ip] = (ip, title, version)
+    else:
+        logger.debug("Received incomplete announcement, missing required fields")
+
 
 async def listen_for_boards() -> None:
     """
@@ -16,12 +60,8 @@ async def listen_for_boards() -> None:
     """
     global recv_sock
     logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger(__name__)
     logger.info("Listening for board announcements...")
 
-    # The UDP port used for discovery
-    DISCOVERY_PORT = 37020
-
     # Create socket only if it doesn't exist
     if recv_sock is None:
         try:
@@ -43,26 +83,8 @@ async def listen_for_boards() -> None:
                 # No more data available
                 break
 
-            try:
-                msg = json.loads(data.decode("utf-8"))
-                logger.debug(f"Received message: {msg}")
-            except json.JSONDecodeError:
-                continue
-
-            # Check for required fields
-            if "name" in msg and "version" in msg and "ip" in msg:
-                title = msg["name"]
-                version = msg["version"]
-                ip = msg["ip"]  # Use IP from the message
-
-                logger.info(f"Board announcement from {title} at {ip} (version: {version})")
-
-                # Update database
-                await Machine.upsert(
-                    id=ip, ip=ip, title=title, version=version, last_seen=datetime.now()
-                )
-            else:
-                logger.debug("Received incomplete announcement, missing required fields")
+            capture_packet(DISCOVERY_PORT, data, addr)
+            await handle_packet(data, addr)
 
     except Exception as e:
         logger.error(f"Error while listening for boards: {e}")
@@ -2,30 +2,146 @@ import asyncio
 import json
 import logging
 import socket
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
 
-from db.conn import AsyncDatabase, Play
+from db.conn import AsyncDatabase, GameState, Play
+from jobs import game_tracker
+from jobs.ingest_queue import ingest_queue
+from jobs.packet_capture import capture_packet
+
+# The UDP port used for final scores
+FINAL_SCORE_PORT = 37022
 
 # Global socket variable that persists between function calls
 recv_sock = None
 
+logger = logging.getLogger(__name__)
+
+
+def decode_packet(data: bytes) -> Optional[Dict[str, Any]]:
+    """
+    Decode a final score datagram, returning None if it isn't valid JSON.
+    """
+    try:
+        msg = json.loads(data.decode("utf-8"))
+        logger.info(f"Received message: {msg}")
+        # example:
+        # [0, ("ABC", 42340), ("DEF", 1230), ("", 0), ("", 0)],
+    except json.JSONDecodeError as e:
+        logger.error(f"Failed to decode JSON: {e}")
+        return None
+    return msg
+
+
+async def handle_packet(
+    data: bytes, addr: Tuple[str, int], received_at: Optional[datetime] = None
+) -> None:
+    """
+    Handle a single final score datagram.
+
+    Args:
+        received_at: When the datagram arrived, defaults to now. Replays pass the capture time.
+    """
+    msg = decode_packet(data)
+    if msg is not None:
+        await handle_message(msg, received_at or datetime.now())
+
+
+async def load_game(machine_id: str) -> Optional[game_tracker.TrackedGame]:
+    """
+    Load a machine's last finished game, and any game in progress, from the db into the
+    game tracker. Used when nothing was tracked for the machine since startup.
+    """
+    con = await AsyncDatabase.get_instance()
+    query = """
+        SELECT id, active
+        FROM games
+        WHERE machine_id = $1
+        ORDER BY date DESC
+        LIMIT 1
+    """
+    latest = await con.fetchone(query, (machine_id,))
+    if latest is None:
+        return None
+    if latest["active"] and machine_id not in game_tracker.active_games:
+        game_tracker.game_started(machine_id, latest["id"])
+
+    query = """
+        SELECT id
+        FROM games
+        WHERE machine_id = $1 AND NOT active
+        ORDER BY date DESC
+        LIMIT 1
+    """
+    ended = await con.fetchone(query, (machine_id,))
+    if ended is None:
+        return None
+
+    query = "SELECT initials, score FROM plays WHERE game_id = $1 ORDER BY id"
+    plays = await con.fetchall(query, (ended["id"],))
+    final_score = tuple((play["initials"], play["score"]) for play in plays) or None
+    return game_tracker.remember_ended_game(machine_id, ended["id"], final_score)
+
+
+async def handle_message(msg: Dict[str, Any], received_at: datetime) -> None:
+    """
+    Write a decoded final score to the database.
+    """
+    machine_id = msg["game_ip"]
+    final_score = game_tracker.score_entries(msg["game"][1:])  # Skip the game number
+
+    # The game this score is for is the one the game state listener most recently saw end
+    game = game_tracker.last_ended_game(machine_id)
+    if game is None:
+        # Nothing tracked since startup, fall back to the machine's games in the db
+        game = await load_game(machine_id)
+
+    if game is not None and not game.scored:
+        game_id = game.game_id
+    elif game is not None and game.final_score == final_score:
+        # Boards repeat final scores, possibly after the next game has started
+        logger.info(f"Ignoring duplicate final score for game {game.game_id} on {machine_id}")
+        return
+    elif machine_id in game_tracker.active_games:
+        # The score arrived before the game's end was processed, write it once it is
+        game_tracker.hold_final_score(machine_id, msg, received_at)
+        return
+    elif game is not None:
+        logger.info(f"Ignoring final score for already scored game {game.game_id} on {machine_id}")
+        return
+    else:
+        logger.error(f"No game found for {machine_id}")
+        return
+
+    duration_seconds = await GameState.duration_seconds(game_id)
+
+    # for each non zero score in the message, add a play to the game
+    for initials, score in final_score:
+        await Play.new(
+            game_id=game_id,
+            score=score,
+            initials=initials,
+            duration_seconds=duration_seconds,
+        )
+
+    game_tracker.mark_scored(machine_id, game_id, final_score)
+
 
 async def listen_for_game_final_score() -> None:
     await Play.initialize()
 
     global recv_sock
     logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger(__name__)
-
-    GAME_STATE_PORT = 37022
 
     # Create socket only if it doesn't exist
     if recv_sock is None:
         try:
             recv_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             recv_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            recv_sock.bind(("0.0.0.0", GAME_STATE_PORT))
+            recv_sock.bind(("0.0.0.0", FINAL_SCORE_PORT))
             recv_sock.setblocking(False)
-            logger.info(f"Created socket listening on UDP port {GAME_STATE_PORT}")
+            logger.info(f"Created socket listening on UDP port {FINAL_SCORE_PORT}")
         except Exception as e:
             logger.error(f"Failed to set up socket: {e}")
             return
@@ -37,52 +153,20 @@ async def listen_for_game_final_score() -> None:
             while True:
                 try:
                     data, addr = recv_sock.recvfrom(1024)
+                    received_at = datetime.now()
                     # TODO check for malformed msgs
                 except BlockingIOError:
                     # No more data available
                     break
 
-                try:
-                    msg = json.loads(data.decode("utf-8"))
-                    logger.info(f"Received message: {msg}")
-                    # example:
-                    # [0, ("ABC", 42340), ("DEF", 1230), ("", 0), ("", 0)],
-                except json.JSONDecodeError as e:
-                    logger.error(f"Failed to decode JSON: {e}")
+                capture_packet(FINAL_SCORE_PORT, data, addr)
+                msg = decode_packet(data)
+                if msg is None:
                     continue
 
-                con = await AsyncDatabase.get_instance()
-
-                # Find the most recent inactive game this is for based on the IP
-                query = """
-                    SELECT
-                        games.id,
-                        game_states.state,
-                        games.active
-                    FROM games
-                    LEFT JOIN game_states
-                        ON game_states.game_id = games.id
-                    WHERE games.machine_id = $1
-                        AND games.active = false
-                    ORDER by games.date DESC
-                """
-                params = (msg["game_ip"],)
-                result = await con.fetchone(query, params)
-
-                # If no game is found, raise an error
-                if result is None:
-                    logger.error(f"No game found for {msg['game_ip']}")
-                    continue
-
-                # for each non zero score in the message, add a play to the game
-                for player in msg["game"][1:]:  # Skip the first element which is the game number
-                    # if the score is 0, skip it
-                    if player[1] == 0:
-                        continue
-
-                    # Add the score
-                    await Play.new(game_id=result["id"], score=player[1], initials=player[0])
-                    # TODO calculate the seconds based on game states
+                # Database writes happen in process_ingest_queue, so a slow db can't
+                # stall the socket
+                ingest_queue.put_final_score(msg, received_at)
 
         except Exception as e:
             logger.error(f"Error while listening for boards: {e}")
@@ -3,12 +3,115 @@ import json
 import logging
 import socket
 from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
 
 from db.conn import AsyncDatabase, Game, GameState
+from jobs import game_tracker, listen_for_game_final_score
+from jobs.ingest_queue import ingest_queue
+from jobs.packet_capture import capture_packet
+
+# The UDP port used for game state updates
+GAME_STATE_PORT = 37021
 
 # Global socket variable that persists between function calls
 recv_sock = None
 
+logger = logging.getLogger(__name__)
+
+
+def decode_packet(data: bytes) -> Optional[Dict[str, Any]]:
+    """
+    Decode a game state datagram, returning None if it isn't valid JSON.
+    """
+    try:
+        msg = json.loads(data.decode("utf-8"))
+    except json.JSONDecodeError as e:
+        logger.error(f"Failed to decode JSON: {e}")
+        return None
+    return msg
+
+
+async def handle_packet(
+    data: bytes, addr: Tuple[str, int], received_at: Optional[datetime] = None
+) -> None:
+    """
+    Handle a single game state datagram.
+
+    Args:
+        received_at: When the datagram arrived, defaults to now. Replays pass the capture time.
+    """
+    msg = decode_packet(data)
+    if msg is not None:
+        await handle_message(msg, received_at or datetime.now())
+
+
+async def handle_message(msg: Dict[str, Any], received_at: datetime) -> None:
+    """
+    Write a decoded game state to the database.
+    """
+    con = await AsyncDatabase.get_instance()
+
+    # Find the game this is for based on the IP, and if thre's an active game
+    query = """
+        SELECT
+            games.id,
+            game_states.state,
+            games.active
+        FROM games
+        LEFT JOIN game_states
+            ON game_states.game_id = games.id
+        WHERE games.machine_id = $1
+        ORDER by games.date DESC
+    """
+    params = (msg["game_ip"],)
+    result = await con.fetchone(query, params)
+
+    # If no game is found, create a new one
+    if result is None:
+        logger.info(f"No game found for {msg['game_ip']}, creating a new one")
+        game = await Game.new(
+            machine_id=msg["game_ip"],
+            date=received_at,
+            active=msg["game_status"]["GameActive"],
+        )
+        if game["active"]:
+            game_tracker.game_started(msg["game_ip"], game["id"])
+        result = await con.fetchone(query, params)
+
+    # if current game is active and game in db is not, create a new game
+    if msg["game_status"]["GameActive"] and not result["active"]:
+        logger.info(f"Game is active, creating a new game for {msg['game_ip']}")
+        game = await Game.new(machine_id=msg["game_ip"], date=received_at, active=True)
+        game_tracker.game_started(msg["game_ip"], game["id"])
+        result = await con.fetchone(query, params)
+
+    # if the current game is not active and game in db is, set it to inactive
+    if not msg["game_status"]["GameActive"] and result["active"]:
+        logger.info(f"Ending game for {msg['game_ip']}")
+        await Game.set_active(id=result["id"], active=False)
+        game_tracker.game_ended(msg["game_ip"], result["id"])
+
+        # Write a final score that arrived before this end transition was processed
+        held = game_tracker.pop_held_final_score(msg["game_ip"])
+        if held is not None:
+            await listen_for_game_final_score.handle_message(*held)
+        return
+
+    if not result["active"] and not msg["game_status"]["GameActive"]:
+        return
+
+    # if the game status is the same as the last one, ignore it
+    if result["state"] == msg["game_status"]:
+        return
+
+    # else add the new game state
+    await GameState.new(
+        game_id=result["id"],
+        state=json.dumps(msg["game_status"]),
+        timestamp=received_at,
+    )
+    logger.info(f"Game state updated for {msg['game_ip']}: {msg['game_status']}")
+
 
 async def listen_for_game_state() -> None:
     """
@@ -19,10 +122,6 @@ async def listen_for_game_state() -> None:
 
     global recv_sock
     logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger(__name__)
-
-    # The UDP port used for discovery
-    GAME_STATE_PORT = 37021
 
     # Create socket only if it doesn't exist
     if recv_sock is None:
@@ -43,70 +142,23 @@ async def listen_for_game_state() -> None:
             while True:
                 try:
                     data, addr = recv_sock.recvfrom(1024)
+                    received_at = datetime.now()
                     # TODO check for malformed msgs
                 except BlockingIOError:
                     # No more data available
                     break
 
-                try:
-                    msg = json.loads(data.decode("utf-8"))
-                except json.JSONDecodeError as e:
-                    logger.error(f"Failed to decode JSON: {e}")
-                    continue
-
-                con = await AsyncDatabase.get_instance()
-
-                # Find the game this is for based on the IP, and if thre's an active game
-                query = """
-                    SELECT
-                        games.id,
-                        game_states.state,
-                        games.active
-                    FROM games
-                    LEFT JOIN game_states
-                        ON game_states.game_id = games.id
-                    WHERE games.machine_id = $1
-                    ORDER by games.date DESC
-                """
-                params = (msg["game_ip"],)
-                result = await con.fetchone(query, params)
-
-                # If no game is found, create a new one
-                if result is None:
-                    logger.info(f"No game found for {msg['game_ip']}, creating a new one")
-                    await Game.new(
-                        machine_id=msg["game_ip"],
-                        date=datetime.now(),
-                        active=msg["game_status"]["GameActive"],
-                    )
-                    result = await con.fetchone(query, params)
-
-                # if current game is active and game in db is not, create a new game
-                if msg["game_status"]["GameActive"] and not result["active"]:
-                    logger.info(f"Game is active, creating a new game for {msg['game_ip']}")
-                    await Game.new(machine_id=msg["game_ip"], date=datetime.now(), active=True)
-                    result = await con.fetchone(query, params)
-
-                # if the current game is not active and game in db is, set it to inactive
-                if not msg["game_status"]["GameActive"] and result["active"]:
-                    logger.info(f"Ending game for {msg['game_ip']}")
-                    await Game.set_active(id=result["id"], active=False)
-                    continue
-
-                if not result["active"] and not msg["game_status"]["GameActive"]:
+                capture_packet(GAME_STATE_PORT, data, addr)
+                msg = decode_packet(data)
+                if msg is None:
                     continue
 
-                # if the game status is the same as the last one, ignore it
-                if result["state"] == msg["game_status"]:
-                    continue
-
-                # else add the new game state
-                await GameState.new(
-                    game_id=result["id"],
-                    state=json.dumps(msg["game_status"]),
-                    timestamp=datetime.now(),
-                )
-                logger.info(f"Game state updated for {msg['game_ip']}: {msg['game_status']}")
+                # Database writes happen in process_ingest_queue, so a slow db can't
+                # stall the socket
+                try:
+                    ingest_queue.put_game_state(msg, received_at)
+                except (KeyError, TypeError) as e:
+                    logger.error(f"Malformed game state from {addr}: {e}")
 
         except Exception as e:
             logger.error(f"Error while listening for boards: {e}")
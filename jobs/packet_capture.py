@@ -0,0 +1,96 @@
+import logging
+import os
+import socket
+import struct
+import time
+from typing import Iterator, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Written once at the start of every capture file
+CAPTURE_MAGIC = b"BRAGCAP1"
+
+# Record header: receive time, source IPv4 address, source port, listener port, payload length
+RECORD_HEADER = struct.Struct("<d4sHHH")
+
+
+class CapturedPacket(NamedTuple):
+    timestamp: float
+    addr: Tuple[str, int]
+    port: int
+    data: bytes
+
+
+class PacketCapture:
+    """Append-only log of the raw datagrams received by the UDP listeners"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(CAPTURE_MAGIC)
+            self.file.flush()
+
+    def write(self, port: int, data: bytes, addr: Tuple[str, int]) -> None:
+        header = RECORD_HEADER.pack(
+            time.time(), socket.inet_aton(addr[0]), addr[1], port, len(data)
+        )
+        self.file.write(header + data)
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+# Global capture that persists between function calls, opened on first use
+_capture: Optional[PacketCapture] = None
+
+
+def get_capture() -> Optional[PacketCapture]:
+    """Get the capture log configured by PACKET_CAPTURE_PATH, or None if capture is disabled"""
+    global _capture
+    path = os.getenv("PACKET_CAPTURE_PATH")
+    if not path:
+        return None
+    if _capture is None:
+        try:
+            _capture = PacketCapture(path)
+            logger.info(f"Capturing UDP packets to {path}")
+        except OSError as e:
+            logger.error(f"Failed to open packet capture {path}: {e}")
+            return None
+    return _capture
+
+
+def capture_packet(port: int, data: bytes, addr: Tuple[str, int]) -> None:
+    """Record a received datagram if capture is enabled"""
+    capture = get_capture()
+    if capture is None:
+        return
+    try:
+        capture.write(port, data, addr)
+    except (OSError, ValueError) as e:
+        logger.error(f"Failed to capture packet from {addr}: {e}")
+
+
+def read_capture(path: str) -> Iterator[CapturedPacket]:
+    """Iterate over the packets in a capture file in the order they were received"""
+    with open(path, "rb") as f:
+        if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError(f"{path} is not a packet capture")
+
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                # End of file, or a record cut short by a crash while writing
+                break
+
+            timestamp, ip, src_port, port, length = RECORD_HEADER.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                break
+
+            yield CapturedPacket(timestamp, (socket.inet_ntoa(ip), src_port), port, data)
@@ -0,0 +1,34 @@
+import logging
+
+from db.conn import GameState, Play
+from jobs import listen_for_game_final_score, listen_for_game_state
+from jobs.ingest_queue import FINAL_SCORE, GAME_STATE, ingest_queue
+
+logger = logging.getLogger(__name__)
+
+# Database writer for each kind of queued message
+HANDLERS = {
+    GAME_STATE: listen_for_game_state.handle_message,
+    FINAL_SCORE: listen_for_game_final_score.handle_message,
+}
+
+
+async def process_ingest_queue() -> None:
+    """
+    Write the messages queued by the UDP receive loops to the database.
+    This function is designed to be called regularly from a FastAPI scheduler.
+    """
+    await GameState.initialize()
+    await Play.initialize()
+
+    while True:
+        kind, msg, received_at = await ingest_queue.get()
+        try:
+            await HANDLERS[kind](msg, received_at)
+        except Exception as e:
+            logger.error(f"Error while writing {kind} for {msg.get('game_ip')}: {e}")
+            # log a stack trace
+            import traceback
+
+            logger.error(traceback.format_exc())
+        ingest_queue.stats["processed"] += 1
@@ -0,0 +1,92 @@
+"""
+Replay a packet capture through the UDP listener handlers.
+
+Usage:
+    python -m jobs.replay_capture captures/ingest.cap            # original speed
+    python -m jobs.replay_capture captures/ingest.cap --fast     # as fast as possible
+    python -m jobs.replay_capture captures/ingest.cap --speed 10 # 10x original speed
+
+Point DATABASE_NAME at a scratch database to rebuild it from a capture.
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+from datetime import datetime
+
+from db.conn import GameState, Play
+from jobs import listen_for_boards, listen_for_game_final_score, listen_for_game_state
+from jobs.packet_capture import read_capture
+
+logger = logging.getLogger(__name__)
+
+# Handler for the packets received on each listener port
+HANDLERS = {
+    listen_for_boards.DISCOVERY_PORT: listen_for_boards.handle_packet,
+    listen_for_game_state.GAME_STATE_PORT: listen_for_game_state.handle_packet,
+    listen_for_game_final_score.FINAL_SCORE_PORT: listen_for_game_final_score.handle_packet,
+}
+
+
+async def replay_capture(path: str, speed: float = 1.0) -> int:
+    """
+    Feed every packet in a capture back through its listener's handler.
+
+    Args:
+        path: The capture file to replay
+        speed: Playback speed relative to the original timing, 0 to replay as fast as possible
+
+    Returns:
+        The number of packets replayed
+    """
+    await GameState.initialize()
+    await Play.initialize()
+
+    count = 0
+    first_capture_time = None
+    replay_start = time.monotonic()
+
+    for packet in read_capture(path):
+        handler = HANDLERS.get(packet.port)
+        if handler is None:
+            logger.warning(f"No handler for packets captured on port {packet.port}")
+            continue
+
+        # Wait until the packet is due relative to the start of the capture
+        if speed > 0:
+            if first_capture_time is None:
+                first_capture_time = packet.timestamp
+            due = (packet.timestamp - first_capture_time) / speed
+            delay = due - (time.monotonic() - replay_start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        try:
+            # Stamp rows with the original receive time, not the time of the replay
+            await handler(packet.data, packet.addr, datetime.fromtimestamp(packet.timestamp))
+        except Exception as e:
+            logger.error(f"Error replaying packet from {packet.addr}: {e}")
+        count += 1
+
+    elapsed = time.monotonic() - replay_start
+    rate = count / elapsed if elapsed > 0 else 0
+    logger.info(f"Replayed {count} packets in {elapsed:.2f}s ({rate:.0f} packets/s)")
+    return count
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+
+    parser = argparse.ArgumentParser(description="Replay a UDP packet capture")
+    parser.add_argument("path", help="capture file written with PACKET_CAPTURE_PATH")
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="playback speed relative to the original"
+    )
+    parser.add_argument("--fast", action="store_true", help="replay as fast as possible")
+    args = parser.parse_args()
+
+    asyncio.run(replay_capture(args.path, speed=0 if args.fast else args.speed))
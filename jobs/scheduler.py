@@ -5,10 +5,12 @@ from datetime import datetime
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from fastapi import FastAPI
 
+from jobs.collect_backglass_images import collect_backglass_images
 from jobs.collect_highscores import collect_highscores
 from jobs.listen_for_boards import listen_for_boards
 from jobs.listen_for_game_final_score import listen_for_game_final_score
 from jobs.listen_for_game_state import listen_for_game_state
+from jobs.process_ingest_queue import process_ingest_queue
 
 # Scheduler instance
 scheduler = AsyncIOScheduler()
@@ -45,6 +47,15 @@ async def app_lifespan(app: FastAPI):
         next_run_time=datetime.now(),
     )
 
+    scheduler.add_job(
+        func=collect_backglass_images,
+        trigger="interval",
+        seconds=60 * 5,
+        id="collect_backglass_images",
+        replace_existing=True,
+        next_run_time=datetime.now(),
+    )
+
     scheduler.add_job(
         func=listen_for_game_final_score,
         trigger="interval",
@@ -54,6 +65,15 @@ async def app_lifespan(app: FastAPI):
         next_run_time=datetime.now(),
     )
 
+    scheduler.add_job(
+        func=process_ingest_queue,
+        trigger="interval",
+        seconds=60 * 5,
+        id="process_ingest_queue",
+        replace_existing=True,
+        next_run_time=datetime.now(),
+    )
+
     scheduler.start()
 
     yield
@@ -1,23 +1,48 @@
+import json
 import logging
+import os
 import time
 
 import uvicorn
-from fastapi import FastAPI
-from fastapi.encoders import jsonable_encoder
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 
-from db.conn import AsyncDatabase, Machine
+from api.caching import cached_response
+from api.compression import CompressionMiddleware
+from api.profiling import TimingMiddleware, get_route_timings, sample_stacks
+from api.responses import FastJSONResponse, rows_response
+from api.static import AssetStaticFiles
+from db.conn import AsyncDatabase, BackglassImage, Game, Machine, Play
+from jobs.collect_backglass_images import BACKGLASS_DIR
+from jobs.ingest_queue import ingest_queue
 from jobs.scheduler import app_lifespan
 
 time.sleep(5)
 
-app = FastAPI(lifespan=app_lifespan)
+app = FastAPI(lifespan=app_lifespan, default_response_class=FastJSONResponse)
+app.add_middleware(CompressionMiddleware, minimum_size=500)
+app.add_middleware(TimingMiddleware)
+
+# Assets referenced from html pages by content-hashed URL
+ASSET_DIRS = {"/css": "web/css", "/js": "web/js"}
 
 # Mount the static files directory
-app.mount("/html", StaticFiles(directory="web/html", html=True), name="static")
-app.mount("/css", StaticFiles(directory="web/css", html=True), name="static")
-app.mount("/js", StaticFiles(directory="web/js", html=True), name="static")
+app.mount(
+    "/html",
+    AssetStaticFiles(directory="web/html", html=True, asset_dirs=ASSET_DIRS),
+    name="static",
+)
+app.mount("/css", AssetStaticFiles(directory="web/css", html=True), name="static")
+app.mount("/js", AssetStaticFiles(directory="web/js", html=True), name="static")
+
+# Backglass images are stored under their content hash, so they never change
+os.makedirs(BACKGLASS_DIR, exist_ok=True)
+app.mount(
+    "/img/backglass",
+    AssetStaticFiles(directory=BACKGLASS_DIR, immutable=True),
+    name="backglass",
+)
 app.mount("/img", StaticFiles(directory="web/img", html=True), name="static")
 
 
@@ -28,29 +53,54 @@ async def redirect_to_index():
 
 @app.exception_handler(404)
 async def not_found_handler(request, exc):
-    return JSONResponse(
+    return FastJSONResponse(
         status_code=404,
         content={"message": "Resource not found"},
     )
 
 
+# Date filter for each highscore time window
+TIME_WINDOW_FILTERS = {
+    "all": "TRUE",
+    "year": "games.date >= CURRENT_DATE - INTERVAL '365 days'",
+    "month": "games.date >= CURRENT_DATE - INTERVAL '30 days'",
+    "week": "games.date >= CURRENT_DATE - INTERVAL '7 days'",
+    "day": "games.date >= CURRENT_DATE",
+}
+
+
 @app.get("/api/machines/list")
-async def machines_list():
+async def machines_list(request: Request, format: str = "rows"):
     """
     Get the list of machines.
+
+    Args:
+        format: Response layout (rows, columns)
     """
-    machines = await Machine.all()
-    return JSONResponse(content=jsonable_encoder(machines))
+
+    # last_seen is in the body, so heartbeats have to change the ETag too
+    tables = ("machines", Machine.last_seen_version)
+
+    async def build():
+        await Machine.initialize()
+        con = await AsyncDatabase.get_instance()
+        machines = await con.fetchall('SELECT * FROM "machines"', read_only=True, tables=tables)
+        return rows_response(machines, format)
+
+    return await cached_response(request, tables, build)
 
 
 @app.get("/api/machines/{machine_id}/highscores")
-async def machine_highscores(machine_id: str, time_window: str = "all"):
+async def machine_highscores(
+    request: Request, machine_id: str, time_window: str = "all", format: str = "rows"
+):
     """
     Get the highscores for a specific machine.
 
     Args:
         machine_id: The ID of the machine
         time_window: Time window for highscores (all, year, month, week, day)
+        format: Response layout (rows, columns)
     """
     # Base query
     query = """
@@ -67,22 +117,143 @@ async def machine_highscores(machine_id: str, time_window: str = "all"):
     """
 
     # Add date filter based on time window
-    if time_window == "year":
-        query += " AND games.date >= CURRENT_DATE - INTERVAL '365 days'"
-    elif time_window == "month":
-        query += " AND games.date >= CURRENT_DATE - INTERVAL '30 days'"
-    elif time_window == "week":
-        query += " AND games.date >= CURRENT_DATE - INTERVAL '7 days'"
-    elif time_window == "day":
-        query += " AND games.date >= CURRENT_DATE"
+    query += f" AND {TIME_WINDOW_FILTERS.get(time_window, 'TRUE')}"
 
     # Add ordering
     query += " ORDER BY plays.score DESC"
 
-    con = await AsyncDatabase.get_instance()
-    result = await con.fetchall(query, (machine_id,))
+    async def build():
+        con = await AsyncDatabase.get_instance()
+        result = await con.fetchall(query, (machine_id,), read_only=True, tables=("games", "plays"))
+        return rows_response(result, format)
+
+    return await cached_response(
+        request, ("games", "plays"), build, changes_daily=time_window != "all"
+    )
 
-    return JSONResponse(content=jsonable_encoder(result))
+
+@app.get("/api/dashboard")
+async def dashboard(request: Request, windows: str = "day,week,month,all", limit: int = 10):
+    """
+    Get every machine with its top highscores for each time window in one response.
+
+    Args:
+        windows: Comma separated time windows (all, year, month, week, day)
+        limit: Number of highscores per machine and time window
+    """
+    time_windows = [window.strip() for window in windows.split(",") if window.strip()]
+    invalid = [window for window in time_windows if window not in TIME_WINDOW_FILTERS]
+    if not time_windows or invalid:
+        return FastJSONResponse(
+            status_code=400,
+            content={"message": f"windows must be from: {', '.join(TIME_WINDOW_FILTERS)}"},
+        )
+    if limit < 1:
+        return FastJSONResponse(status_code=400, content={"message": "limit must be positive"})
+
+    # Rank every machine's plays within each window and keep the top ones, in one statement
+    ranked = " UNION ALL ".join(
+        f"""
+            SELECT
+                '{window}' AS time_window,
+                games.machine_id,
+                plays.initials,
+                plays.score,
+                games.date,
+                ROW_NUMBER() OVER (
+                    PARTITION BY games.machine_id ORDER BY plays.score DESC
+                ) AS rank
+            FROM games
+            JOIN plays
+                ON plays.game_id = games.id
+            WHERE {TIME_WINDOW_FILTERS[window]}
+        """
+        for window in dict.fromkeys(time_windows)
+    )
+    query = f"""
+        SELECT time_window, machine_id, initials, score, date
+        FROM ({ranked}) AS ranked
+        WHERE rank <= $1
+        ORDER BY machine_id, time_window, rank
+    """
+
+    async def build():
+        await Game.initialize()
+        await Play.initialize()
+        machines = await Machine.all(read_only=True)
+        backglasses = {
+            image["id"]: json.loads(image["variants"])
+            for image in await BackglassImage.all(read_only=True)
+        }
+        con = await AsyncDatabase.get_instance()
+        scores = await con.fetchall(query, (limit,), read_only=True, tables=("games", "plays"))
+
+        highscores = {
+            machine["id"]: {window: [] for window in time_windows} for machine in machines
+        }
+        for score in scores:
+            machine_scores = highscores.get(score.pop("machine_id"))
+            if machine_scores is not None:
+                machine_scores[score.pop("time_window")].append(score)
+
+        return FastJSONResponse(
+            content=[
+                {
+                    # last_seen changes with every heartbeat, leave it out so the ETag holds
+                    **{key: value for key, value in machine.items() if key != "last_seen"},
+                    "backglass": backglasses.get(machine["id"], []),
+                    "highscores": highscores[machine["id"]],
+                }
+                for machine in machines
+            ]
+        )
+
+    return await cached_response(
+        request, ("machines", "games", "plays", "backglass_images"), build, changes_daily=True
+    )
+
+
+@app.get("/api/ingest/stats")
+async def ingest_stats():
+    """
+    Get the ingest queue counters: messages received, coalesced, dropped and processed.
+    """
+    return ingest_queue.get_stats()
+
+
+@app.get("/api/debug/timings")
+async def debug_timings():
+    """
+    Get request counts and durations for each route.
+    """
+    return get_route_timings()
+
+
+@app.get("/api/debug/slow-queries")
+async def debug_slow_queries():
+    """
+    Get the most recent queries slower than SLOW_QUERY_MS, newest first.
+    """
+    return list(reversed(AsyncDatabase.slow_queries))
+
+
+@app.get("/api/debug/profile")
+async def debug_profile(seconds: float = 10, interval_ms: float = 5):
+    """
+    Sample the running app's stacks for a while.
+
+    Args:
+        seconds: How long to sample for (at most 60)
+        interval_ms: Time between samples
+
+    Returns the samples in collapsed stack format, for flamegraph.pl or speedscope.
+    """
+    if not 0 < seconds <= 60 or interval_ms <= 0:
+        return FastJSONResponse(
+            status_code=400,
+            content={"message": "seconds must be in (0, 60] and interval_ms positive"},
+        )
+    return PlainTextResponse(await sample_stacks(seconds, interval_ms / 1000))
 
 
 @app.delete("/api/db/delete")
@@ -111,16 +282,23 @@ async def delete_all():
 
     # mark all tables as uninitialized
     AsyncDatabase._initialized_tables = set()
+    AsyncDatabase.bump_data_version()
 
 
 @app.post("/api/db/query")
-async def execute_query(query: str):
+async def execute_query(query: str, format: str = "rows"):
     """
     Execute a raw SQL query.
+
+    Args:
+        query: The SQL to run
+        format: Response layout (rows, columns)
     """
     con = await AsyncDatabase.get_instance()
     result = await con.fetchall(query)
-    return JSONResponse(content=jsonable_encoder(result))
+    # The query may have written to any table
+    AsyncDatabase.bump_data_version()
+    return rows_response(result, format)
 
 
 if __name__ == "__main__":
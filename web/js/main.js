@@ -6,6 +6,7 @@ document.addEventListener('DOMContentLoaded', () => {
         scrollDelay: 5000,            // Milliseconds before scrolling to next page
         machineDisplayTime: 20000,    // Time to display each machine (ms)
         fadeTransitionTime: 800,      // Fade animation duration (ms)
+        scoresPerWindow: 50,          // Highscores fetched per machine and time window
     };
 
     // Time windows for the quadrants
@@ -14,11 +15,11 @@ document.addEventListener('DOMContentLoaded', () => {
     // State variables
     let machines = [];
     let currentMachineIndex = 0;
-    let allScores = {};
     let isScrolling = {};
 
     // DOM Elements
     const machineTitle = document.getElementById('machine-title');
+    const machineBackglass = document.getElementById('machine-backglass');
     const clockElement = document.getElementById('clock');
     const statusMessage = document.getElementById('status-message');
 
@@ -36,7 +37,7 @@ document.addEventListener('DOMContentLoaded', () => {
     async function initApp() {
         updateClock();
         try {
-            await loadMachines();
+            await loadDashboard();
             if (machines.length > 0) {
                 await loadAndDisplayAllTimeWindows(machines[0].id);
 
@@ -53,10 +54,15 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    async function loadMachines() {
+    async function loadDashboard() {
         try {
             statusMessage.textContent = 'Loading machines...';
-            const response = await fetch('/api/machines/list');
+            // All machines with their highscores for every time window in one request
+            const params = new URLSearchParams({
+                windows: timeWindows.join(','),
+                limit: config.scoresPerWindow,
+            });
+            const response = await fetch(`/api/dashboard?${params}`);
 
             if (!response.ok) {
                 throw new Error(`HTTP error ${response.status}`);
@@ -85,15 +91,12 @@ document.addEventListener('DOMContentLoaded', () => {
 
             // Update machine title
             machineTitle.textContent = currentMachine.title;
+            displayBackglass(currentMachine.backglass);
 
-            // Initialize scores cache for this machine if needed
-            if (!allScores[machineId]) {
-                allScores[machineId] = {};
-            }
-
-            // Load scores for each time window in parallel
-            const loadPromises = timeWindows.map(window => loadTimeWindowScores(machineId, window));
-            await Promise.all(loadPromises);
+            // Display scores for each time window
+            timeWindows.forEach(window => {
+                displayScores(currentMachine.highscores[window], window);
+            });
 
             statusMessage.textContent = `Showing scores for ${currentMachine.title}`;
         } catch (error) {
@@ -101,25 +104,19 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    async function loadTimeWindowScores(machineId, timeWindow) {
-        try {
-            // Fetch scores for the machine if we don't have them cached
-            if (!allScores[machineId][timeWindow]) {
-                const response = await fetch(`/api/machines/${machineId}/highscores?time_window=${timeWindow}`);
-
-                if (!response.ok) {
-                    throw new Error(`HTTP error ${response.status}`);
-                }
-
-                allScores[machineId][timeWindow] = await response.json();
-            }
-
-            // Display scores for this time window
-            displayScores(allScores[machineId][timeWindow], timeWindow);
-
-        } catch (error) {
-            showError(`Failed to load ${timeWindow} scores: ${error.message}`);
+    function displayBackglass(variants) {
+        if (!variants || variants.length === 0) {
+            machineBackglass.hidden = true;
+            machineBackglass.removeAttribute('src');
+            machineBackglass.removeAttribute('srcset');
+            return;
         }
+
+        // Let the browser pick the smallest pre-sized variant that fits the display
+        const sized = variants.filter(variant => variant.width);
+        machineBackglass.srcset = sized.map(variant => `${variant.url} ${variant.width}w`).join(', ');
+        machineBackglass.src = variants[variants.length - 1].url;
+        machineBackglass.hidden = false;
     }
 
     function displayScores(scores, timeWindow) {
@@ -250,11 +247,8 @@ document.addEventListener('DOMContentLoaded', () => {
 
     async function refreshData() {
         try {
-            // Refresh machines list
-            await loadMachines();
-
-            // Clear cached scores to force refresh
-            allScores = {};
+            // Refresh machines and their scores
+            await loadDashboard();
 
             // Update current display
             if (machines.length > 0) {